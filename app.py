@@ -1,5 +1,11 @@
+import time
+
 import streamlit as st
-from src.vibe_shopping_agent import VibeShoppingAgent
+from src.find_recommendations import (
+    OutfitRecommendationAgent,
+    get_recommendation_agent as _shared_recommendation_agent,
+)
+from src.vibe_shopping_agent import VibeShoppingAgent, run_in_llm_loop
 
 # Page configuration
 st.set_page_config(
@@ -10,10 +16,22 @@ st.set_page_config(
 )
 
 
+@st.cache_resource(show_spinner="Loading stylist brain...")
+def get_recommendation_agent() -> OutfitRecommendationAgent:
+    """Share the catalog, embedding model and precomputed embeddings across sessions"""
+    return _shared_recommendation_agent()
+
+
+# Warm the model + catalog embeddings at script start, not on the first message
+get_recommendation_agent()
+
+
 def main():
     """Initialize session state variables"""
     if "agent" not in st.session_state:
-        st.session_state.agent = VibeShoppingAgent()
+        st.session_state.agent = VibeShoppingAgent(
+            recommendation_agent=get_recommendation_agent()
+        )
 
     # Initialize loading state
     if "is_loading" not in st.session_state:
@@ -111,17 +129,28 @@ def main():
         with st.chat_message("user"):
             st.write(user_input)
 
-        # Show loading indicator while processing
+        # Process on the persistent LLM loop so the UI can keep updating
+        # while we wait (and so async HTTP state survives across turns)
         with st.chat_message("assistant"):
-            with st.spinner("Thinking about your perfect style..."):
-                try:
-                    st.session_state.is_loading = True
+            placeholder = st.empty()
+            try:
+                st.session_state.is_loading = True
+                future = run_in_llm_loop(
                     st.session_state.agent.process_query(user_input)
-                except Exception as e:
-                    st.error(f"Sorry, I encountered an error: {str(e)}")
-                    st.info("Please try again with a different query.")
-                finally:
-                    st.session_state.is_loading = False
+                )
+                started = time.time()
+                while not future.done():
+                    placeholder.write(
+                        f"Thinking about your perfect style... ({time.time() - started:.0f}s)"
+                    )
+                    time.sleep(0.2)
+                future.result()
+                placeholder.empty()
+            except Exception as e:
+                st.error(f"Sorry, I encountered an error: {str(e)}")
+                st.info("Please try again with a different query.")
+            finally:
+                st.session_state.is_loading = False
 
         # Rerun to update the display
         st.rerun()
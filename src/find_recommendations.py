@@ -1,13 +1,83 @@
+import functools
+import os
 import pandas as pd
+from collections import OrderedDict
 from typing import Dict, List, Tuple
 from dataclasses import dataclass
 from abc import ABC, abstractmethod
 from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
-
-
-@dataclass
+import torch
+from numba import njit
+
+
+@functools.lru_cache(maxsize=4)
+def _load_st_model(model_name: str) -> SentenceTransformer:
+    """Load a SentenceTransformer once per process; the model is pure static state"""
+    torch.set_num_threads(min(4, os.cpu_count() or 1))
+    model = SentenceTransformer(model_name)
+    model.eval()
+    # Product texts are short; capping the sequence length caps attention cost
+    model.max_seq_length = 128
+    try:
+        # Compile just the transformer backbone; encode()/pooling stay eager
+        model[0].auto_model = torch.compile(
+            model[0].auto_model, dynamic=True, mode="reduce-overhead"
+        )
+    except Exception as e:
+        print(f"torch.compile unavailable, using eager encoder: {e}")
+    return model
+
+
+def _parse_budget(completion: Dict) -> Tuple[float, float]:
+    """Extract (budget_min, budget_max) from completion attributes, once"""
+
+    def first_float(values):
+        if isinstance(values, list):
+            for item in values:
+                if isinstance(item, dict) and "value" in item:
+                    try:
+                        return float(item["value"])
+                    except (ValueError, TypeError):
+                        continue
+        return None
+
+    return first_float(completion.get("budget_min")), first_float(
+        completion.get("budget_max")
+    )
+
+
+# Low-cardinality text columns used for attribute matching; stored as
+# pandas Categoricals so Parquet dictionary-encodes them and matching can
+# compare integer codes instead of strings
+_MATCH_COLUMNS = (
+    "category",
+    "fit",
+    "fabric",
+    "color_or_print",
+    "occasion",
+    "sleeve_length",
+    "neckline",
+    "length",
+    "pant_type",
+)
+
+
+@njit(cache=True)
+def _int8_dot_scores(matrix: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """int8 x int8 GEMV with int32 accumulation, without materializing
+    int32 copies of the operands"""
+    rows, dims = matrix.shape
+    scores = np.empty(rows, dtype=np.int32)
+    for i in range(rows):
+        acc = np.int32(0)
+        for j in range(dims):
+            acc += np.int32(matrix[i, j]) * np.int32(query[j])
+        scores[i] = acc
+    return scores
+
+
+@dataclass(slots=True, frozen=True)
 class RecommendationResult:
     """Result of a recommendation query"""
 
@@ -25,7 +95,11 @@ class MatchingStrategy(ABC):
 
     @abstractmethod
     def match(
-        self, completion: Dict, products: pd.DataFrame
+        self,
+        completion: Dict,
+        products: pd.DataFrame,
+        min_score: float = 0.3,
+        max_results: int = 10,
     ) -> List[RecommendationResult]:
         pass
 
@@ -34,7 +108,28 @@ class EmbeddingBasedMatcher(MatchingStrategy):
     """Confidence-weighted embedding-based matching"""
 
     def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
-        self.model = SentenceTransformer(model_name)
+        self.model = _load_st_model(model_name)
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.model.to(self.device)
+        self._autocast_cpu_bf16 = self.device == "cpu" and self._probe_bf16_autocast()
+        # Precomputed catalog state (filled by `precompute`)
+        self._product_texts: List[str] = []
+        self._product_embeddings = None
+        self._product_embeddings_i8 = None
+        self._product_embeddings_t = None
+        self._embedding_scale = 1.0
+        self._prices = None
+        self._ids = None
+        self._names = None
+        self._columns = None
+        self._catalog_lower = None
+        self._column_codes = None
+        # Memoized (attribute, values) -> boolean row mask computations
+        self._match_mask_cache: Dict = {}
+        # LRU of completion-text embeddings (example buttons, user retries)
+        self._query_embedding_cache: OrderedDict = OrderedDict()
+        self._query_cache_size = 512
+        self._catalog_version = 0
         # Attribute importance weights
         self.attribute_weights = {
             "occasion": 1.5,
@@ -49,37 +144,169 @@ class EmbeddingBasedMatcher(MatchingStrategy):
             "length": 0.8,
         }
 
+    def _probe_bf16_autocast(self) -> bool:
+        """Check once whether bf16 autocast works on this CPU/torch build"""
+        try:
+            with torch.inference_mode(), torch.autocast("cpu", dtype=torch.bfloat16):
+                self.model.encode(["probe"], convert_to_numpy=True)
+            return True
+        except Exception:
+            return False
+
+    def _encode(self, texts: List[str], **kwargs) -> np.ndarray:
+        """Run the encoder without autograd, in bf16 where supported"""
+        with torch.inference_mode():
+            if self._autocast_cpu_bf16:
+                with torch.autocast("cpu", dtype=torch.bfloat16):
+                    return self.model.encode(texts, device=self.device, **kwargs)
+            return self.model.encode(texts, device=self.device, **kwargs)
+
+    def _encode_completion(self, text: str) -> np.ndarray:
+        """Encode a completion text, serving repeats from an LRU cache"""
+        cached = self._query_embedding_cache.get(text)
+        if cached is not None:
+            self._query_embedding_cache.move_to_end(text)
+            return cached
+
+        embedding = self._encode(
+            [text], convert_to_numpy=True, normalize_embeddings=True
+        ).astype(np.float32)[0]
+        self._query_embedding_cache[text] = embedding
+        if len(self._query_embedding_cache) > self._query_cache_size:
+            self._query_embedding_cache.popitem(last=False)
+
+        return embedding
+
+    def precompute(self, products: pd.DataFrame) -> None:
+        """Embed the full catalog once so queries only encode the completion text"""
+        self._product_texts = self._build_product_texts(products)
+
+        # Smart batching: sorting by length minimizes padding waste per batch
+        order = np.argsort([len(text) for text in self._product_texts])
+        sorted_texts = [self._product_texts[i] for i in order]
+        if len(sorted_texts) > 1000 and self.device == "cpu":
+            # Large catalogs amortize the worker-pool spin-up across CPU cores
+            pool = self.model.start_multi_process_pool()
+            try:
+                embeddings_sorted = self.model.encode_multi_process(
+                    sorted_texts, pool, batch_size=128, normalize_embeddings=True
+                ).astype(np.float32)
+            finally:
+                self.model.stop_multi_process_pool(pool)
+        else:
+            embeddings_sorted = self._encode(
+                sorted_texts,
+                batch_size=128,
+                show_progress_bar=False,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+            ).astype(np.float32)
+        self._product_embeddings = embeddings_sorted[np.argsort(order)]
+        self._prices = products["price"].to_numpy(dtype=np.float32)
+        self._catalog_lower = self._lower_columns(products)
+        # Dictionary-encoded view: integer codes per row plus the (small)
+        # lowered category vocabulary, so value matching tests categories
+        # once and compares int codes across rows
+        self._column_codes = {}
+        for column_name, series in self._catalog_lower.items():
+            categorical = pd.Categorical(series)
+            self._column_codes[column_name] = (
+                categorical.codes.astype(np.int32),
+                np.asarray(categorical.categories, dtype=object),
+            )
+        # Struct-of-arrays catalog: one ndarray per column; row dicts are
+        # materialized on demand for top-k hits only
+        self._ids = products["id"].to_numpy()
+        self._names = products["name"].to_numpy()
+        self._columns = {name: products[name].to_numpy() for name in products.columns}
+        # Symmetric int8 quantization of the catalog matrix keeps the per-query
+        # matmul working set 4x smaller; scores are rescaled back to ~cosine
+        self._embedding_scale = (
+            float(np.abs(self._product_embeddings).max()) / 127.0 or 1.0
+        )
+        self._product_embeddings_i8 = np.round(
+            self._product_embeddings / self._embedding_scale
+        ).astype(np.int8)
+        # On GPU the similarity GEMV runs on-device in fp16
+        if self.device == "cuda":
+            self._product_embeddings_t = torch.from_numpy(
+                self._product_embeddings
+            ).to(self.device, dtype=torch.float16)
+        self._catalog_version += 1
+
     def match(
-        self, completion: Dict, products: pd.DataFrame
+        self,
+        completion: Dict,
+        products: pd.DataFrame,
+        min_score: float = 0.3,
+        max_results: int = 10,
     ) -> List[RecommendationResult]:
         """Match products using confidence-weighted embedding similarity"""
         completion_text, confidence_scores = self._extract_completion_data(completion)
         avg_confidence = self._calculate_weighted_confidence(confidence_scores)
 
+        # All catalog normalization (texts, embeddings, lowered columns,
+        # indexes) happens exactly once; lazily precompute if a caller skipped it
+        if self._product_embeddings is None or len(self._product_embeddings) != len(
+            products
+        ):
+            self.precompute(products)
+
         # Filter by budget range before embedding calculations
-        filtered_products = self._filter_by_budget(completion, products)
+        prices = self._prices
+        budget_min, budget_max = _parse_budget(completion)
+        mask = self._budget_mask(prices, budget_min, budget_max)
 
-        if filtered_products.empty:
+        if not mask.any():
             return []
 
-        # Generate embeddings
-        product_texts = [
-            self._product_to_text(product)
-            for _, product in filtered_products.iterrows()
+        indices = np.nonzero(mask)[0]
+
+        # Generate embeddings, reusing the precomputed catalog matrix when available
+        completion_embedding = self._encode_completion(completion_text)
+        if self._product_embeddings_t is not None:
+            # fp16 GEMV on the GPU-resident embedding matrix
+            query_t = torch.from_numpy(completion_embedding).to(
+                self.device, dtype=self._product_embeddings_t.dtype
+            )
+            rows = torch.from_numpy(indices).to(self.device)
+            similarities = (
+                (self._product_embeddings_t[rows] @ query_t).float().cpu().numpy()
+            )
+        else:
+            # int8 x int8 dot product, rescaled back to approximate cosine
+            query = completion_embedding
+            query_scale = float(np.abs(query).max()) / 127.0 or 1.0
+            query_i8 = np.round(query / query_scale).astype(np.int8)
+            product_embeddings_i8 = self._product_embeddings_i8[indices]
+            similarities = _int8_dot_scores(product_embeddings_i8, query_i8) * (
+                self._embedding_scale * query_scale
+            )
+
+        # Top-k selection in O(N); only the k survivors get result objects
+        k = min(max_results, len(similarities))
+        top_idx = np.argpartition(similarities, -k)[-k:]
+        top_idx = top_idx[np.argsort(-similarities[top_idx])]
+        top_idx = top_idx[similarities[top_idx] * avg_confidence > min_score]
+
+        # Only the top-k rows are materialized as dicts, from the cached columns
+        global_idx = indices[top_idx]
+        ids = self._ids[global_idx]
+        names = self._names[global_idx]
+        records = [
+            {name: column[i] for name, column in self._columns.items()}
+            for i in global_idx
         ]
-        completion_embedding = self.model.encode([completion_text])
-        product_embeddings = self.model.encode(product_texts)
 
-        # Calculate confidence-weighted similarities
-        similarities = cosine_similarity(completion_embedding, product_embeddings)[0]
+        match_masks = self._attribute_match_masks(completion, self._catalog_lower)
 
         results = []
-        for i, (_, product) in enumerate(filtered_products.iterrows()):
-            base_similarity = similarities[i]
+        for i, sim_idx in enumerate(top_idx):
+            base_similarity = similarities[sim_idx]
             confidence_weighted_score = base_similarity * avg_confidence
 
             matched_attrs, confidence_breakdown = self._get_matched_attributes(
-                completion, product, confidence_scores
+                match_masks, global_idx[i], confidence_scores
             )
 
             reasoning = self._build_reasoning(
@@ -91,67 +318,41 @@ class EmbeddingBasedMatcher(MatchingStrategy):
 
             results.append(
                 RecommendationResult(
-                    product_id=product["id"],
-                    product_name=product["name"],
+                    product_id=ids[i],
+                    product_name=names[i],
                     match_score=confidence_weighted_score,
                     matched_attributes=matched_attrs,
-                    product_details=product.to_dict(),
+                    product_details=records[i],
                     reasoning=reasoning,
                     confidence_breakdown=confidence_breakdown,
                 )
             )
 
-        return sorted(results, key=lambda x: x.match_score, reverse=True)
+        # top_idx is already sorted by descending similarity
+        return results
 
-    def _filter_by_budget(
-        self, completion: Dict, products: pd.DataFrame
-    ) -> pd.DataFrame:
-        """Filter products by budget range"""
-        if "budget_min" not in completion and "budget_max" not in completion:
-            return products
+    def count_in_budget(self, completion: Dict) -> int:
+        """How many catalog rows survive the budget filter alone"""
+        if self._prices is None:
+            return 0
+        budget_min, budget_max = _parse_budget(completion)
+        return int(
+            np.count_nonzero(self._budget_mask(self._prices, budget_min, budget_max))
+        )
 
-        # Extract budget values
-        budget_min = None
-        budget_max = None
-
-        if "budget_min" in completion:
-            budget_min_values = completion["budget_min"]
-            if isinstance(budget_min_values, list) and budget_min_values:
-                # Get the first value with decent confidence
-                for item in budget_min_values:
-                    if isinstance(item, dict) and "value" in item:
-                        try:
-                            budget_min = float(item["value"])
-                            break
-                        except (ValueError, TypeError):
-                            continue
-
-        if "budget_max" in completion:
-            budget_max_values = completion["budget_max"]
-            if isinstance(budget_max_values, list) and budget_max_values:
-                # Get the first value with decent confidence
-                for item in budget_max_values:
-                    if isinstance(item, dict) and "value" in item:
-                        try:
-                            budget_max = float(item["value"])
-                            break
-                        except (ValueError, TypeError):
-                            continue
-
-        # Apply budget filtering
-        filtered_products = products.copy()
+    def _budget_mask(
+        self, prices: np.ndarray, budget_min: float, budget_max: float
+    ) -> np.ndarray:
+        """Build a boolean row mask for the budget range, without copying the catalog"""
+        mask = np.ones(len(prices), dtype=bool)
 
         if budget_min is not None:
-            filtered_products = filtered_products[
-                filtered_products["price"] >= budget_min
-            ]
+            mask &= prices >= budget_min
 
         if budget_max is not None:
-            filtered_products = filtered_products[
-                filtered_products["price"] <= budget_max
-            ]
+            mask &= prices <= budget_max
 
-        return filtered_products
+        return mask
 
     def _extract_completion_data(
         self, completion: Dict
@@ -160,7 +361,8 @@ class EmbeddingBasedMatcher(MatchingStrategy):
         parts = []
         confidence_scores = {}
 
-        for key, value in completion.items():
+        # Sorted keys canonicalize the text so the embedding cache hits reliably
+        for key, value in sorted(completion.items()):
             if isinstance(value, list):
                 values = []
                 confidences = []
@@ -198,15 +400,72 @@ class EmbeddingBasedMatcher(MatchingStrategy):
 
         return weighted_sum / total_weight if total_weight > 0 else 1.0
 
+    @staticmethod
+    def _lower_columns(products: pd.DataFrame) -> Dict[str, pd.Series]:
+        """Lowercased text columns used for attribute-overlap checks"""
+        return {
+            column: products[column].astype(object).fillna("").astype(str).str.lower()
+            for column in _MATCH_COLUMNS
+            if column in products.columns
+        }
+
+    def _attribute_match_masks(
+        self, completion: Dict, catalog_lower: Dict[str, pd.Series]
+    ) -> Dict[str, np.ndarray]:
+        """One vectorized str.contains pass per requested attribute, instead
+        of per-row Python comparisons"""
+        masks = {}
+        for attr, requested in completion.items():
+            column = catalog_lower.get(attr)
+            if column is None or not isinstance(requested, list):
+                continue
+
+            values = [
+                str(item["value"]).lower()
+                for item in requested
+                if isinstance(item, dict) and item.get("value")
+            ]
+            if not values:
+                continue
+
+            # The same (attribute, values) pair recurs across turns; reuse
+            # the scan result instead of re-running the regex over the column
+            cache_key = (attr, frozenset(values), self._catalog_version)
+            mask = self._match_mask_cache.get(cache_key)
+            if mask is None:
+                # Substring-test the tiny category vocabulary, then match
+                # rows by integer code with a SIMD-able np.isin; one
+                # consistent containment semantics for every value shape
+                codes, categories = self._column_codes[attr]
+                hit_codes = np.array(
+                    [
+                        code
+                        for code, category in enumerate(categories)
+                        if any(value in category for value in values)
+                    ],
+                    dtype=np.int32,
+                )
+                mask = np.isin(codes, hit_codes)
+                if len(self._match_mask_cache) > 1024:
+                    self._match_mask_cache.clear()
+                self._match_mask_cache[cache_key] = mask
+            masks[attr] = mask
+
+        return masks
+
     def _get_matched_attributes(
-        self, completion: Dict, product: pd.Series, confidence_scores: Dict[str, float]
+        self,
+        masks: Dict[str, np.ndarray],
+        row: int,
+        confidence_scores: Dict[str, float],
     ) -> Tuple[List[str], Dict[str, float]]:
         """Get matched attributes with their confidence scores"""
         matched_attrs = []
         confidence_breakdown = {}
 
         for attr, confidence in confidence_scores.items():
-            if attr in product and pd.notna(product[attr]):
+            mask = masks.get(attr)
+            if mask is not None and mask[row]:
                 matched_attrs.append(f"{attr}: {confidence:.3f}")
                 confidence_breakdown[attr] = confidence
 
@@ -246,8 +505,8 @@ class EmbeddingBasedMatcher(MatchingStrategy):
 
         return " | ".join(reasoning_parts)
 
-    def _product_to_text(self, product: pd.Series) -> str:
-        """Convert product to text representation"""
+    def _build_product_texts(self, products: pd.DataFrame) -> List[str]:
+        """Convert products to text representations via column arrays, not per-row Series"""
         relevant_attrs = [
             "fit",
             "fabric",
@@ -257,62 +516,77 @@ class EmbeddingBasedMatcher(MatchingStrategy):
             "neckline",
             "length",
             "category",
+            "name",
+            "description",
         ]
 
-        parts = []
+        # Batched column ops: label each present cell, then fold columns together
+        labeled_columns = []
         for attr in relevant_attrs:
-            if attr in product and pd.notna(product[attr]):
-                parts.append(f"{attr}: {product[attr]}")
+            if attr not in products.columns:
+                continue
+            present = products[attr].notna().to_numpy()
+            values = (
+                products[attr].astype(object).fillna("").astype(str)
+            ).to_numpy(dtype=object)
+            labeled_columns.append(np.where(present, attr + ": " + values, ""))
+
+        if not labeled_columns:
+            return [""] * len(products)
 
-        # Add product name and description
-        if "name" in product and pd.notna(product["name"]):
-            parts.append(f"name: {product['name']}")
-        if "description" in product and pd.notna(product["description"]):
-            parts.append(f"description: {product['description']}")
+        texts = labeled_columns[0]
+        for column in labeled_columns[1:]:
+            separator = np.where((texts != "") & (column != ""), "; ", "")
+            texts = texts + separator + column
 
-        return "; ".join(parts)
+        return list(texts)
+
+
+@functools.lru_cache(maxsize=4)
+def _load_catalog(catalog_path: str) -> pd.DataFrame:
+    """Load the product catalog, caching the slow Excel parse as Parquet.
+
+    lru_cache'd so every agent in the process shares one read-only DataFrame.
+    """
+    parquet_path = os.path.splitext(catalog_path)[0] + ".parquet"
+
+    if os.path.exists(parquet_path):
+        return pd.read_parquet(parquet_path)
+
+    catalog = pd.read_excel(catalog_path)
+    for column in _MATCH_COLUMNS:
+        if column in catalog.columns:
+            catalog[column] = catalog[column].astype("category")
+    try:
+        catalog.to_parquet(parquet_path, compression="zstd")
+    except Exception as e:
+        # Best-effort cache; keep working from the xlsx if parquet can't be written
+        print(f"Could not cache catalog as parquet: {e}")
+
+    return catalog
 
 
 class OutfitRecommendationAgent:
     def __init__(self, catalog_path: str = "data/Apparels_shared.xlsx"):
-        self.catalog = pd.read_excel(catalog_path)
+        self.catalog = _load_catalog(catalog_path)
         self.matcher = EmbeddingBasedMatcher()
+        self.matcher.precompute(self.catalog)
 
     def find_recommendations(
         self, completion: Dict, min_score: float = 0.3, max_results: int = 10
     ) -> List[RecommendationResult]:
         """Find recommendations using confidence-weighted matching"""
-        results = self.matcher.match(completion, self.catalog)
+        results = self.matcher.match(
+            completion, self.catalog, min_score=min_score, max_results=max_results
+        )
 
-        # Check if no results due to budget filtering
+        # Check if no results due to budget filtering; scores falling below
+        # min_score while in-budget products exist is a different failure
         if not results:
-            # Check if budget filtering was applied
-            budget_min = None
-            budget_max = None
-
-            if "budget_min" in completion:
-                budget_min_values = completion["budget_min"]
-                if isinstance(budget_min_values, list) and budget_min_values:
-                    for item in budget_min_values:
-                        if isinstance(item, dict) and "value" in item:
-                            try:
-                                budget_min = float(item["value"])
-                                break
-                            except (ValueError, TypeError):
-                                continue
-
-            if "budget_max" in completion:
-                budget_max_values = completion["budget_max"]
-                if isinstance(budget_max_values, list) and budget_max_values:
-                    for item in budget_max_values:
-                        if isinstance(item, dict) and "value" in item:
-                            try:
-                                budget_max = float(item["value"])
-                                break
-                            except (ValueError, TypeError):
-                                continue
-
-            if budget_min is not None or budget_max is not None:
+            budget_min, budget_max = _parse_budget(completion)
+            budget_requested = budget_min is not None or budget_max is not None
+
+            if budget_requested and self.matcher.count_in_budget(completion) == 0:
                 budget_str = ""
                 if budget_min is not None and budget_max is not None:
                     budget_str = f"between ${budget_min} and ${budget_max}"
@@ -330,12 +604,14 @@ class OutfitRecommendationAgent:
                     "I couldn't find exact matches for your vibe. Please start a new conversation."
                 )
 
-        # Filter by confidence-weighted score
-        results = [match for match in results if match.match_score > min_score]
+        # min_score and max_results are already applied in the matcher's top-k step
+        return results
 
-        if not results:
-            raise ValueError(
-                "I couldn't find exact matches for your vibe. Please start a new conversation."
-            )
 
-        return results[:max_results]
+@functools.lru_cache(maxsize=4)
+def get_recommendation_agent(
+    catalog_path: str = "data/Apparels_shared.xlsx",
+) -> OutfitRecommendationAgent:
+    """Shared per-catalog agent: the catalog, embeddings and indexes are
+    immutable, so every session can reuse one instance"""
+    return OutfitRecommendationAgent(catalog_path)
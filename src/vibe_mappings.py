@@ -0,0 +1,105 @@
+import functools
+import re
+import sys
+from typing import Dict, List
+
+import ahocorasick
+from rapidfuzz import fuzz, process
+
+# The mappings file is hand-written pseudo-JSON (comments, trailing commas,
+# occasional missing commas), so it is parsed leniently with regexes
+_BLOCK_RE = re.compile(r'"([^"]+)"\s*:\s*\{(.*?)\}', re.DOTALL)
+_PAIR_RE = re.compile(r'"([^"]+)"\s*:\s*(\[[^\]]*\]|"[^"]*")')
+_STRING_RE = re.compile(r'"([^"]*)"')
+
+
+def _load_vibe_mappings(mappings_path: str) -> Dict[str, Dict[str, tuple]]:
+    """Parse vibe -> attribute-hint blocks from the mappings file"""
+    with open(mappings_path, encoding="utf-8") as f:
+        text = f.read()
+
+    mappings = {}
+    for vibe, body in _BLOCK_RE.findall(text):
+        # Freeze value lists as deduplicated tuples; the mapping is immutable
+        # constant data, so normalization happens exactly once here
+        # Interned keys/values make the hot dict probes pointer comparisons
+        attrs = {
+            sys.intern(key): tuple(
+                sys.intern(v) for v in dict.fromkeys(_STRING_RE.findall(value))
+            )
+            for key, value in _PAIR_RE.findall(body)
+        }
+        attrs = {key: values for key, values in attrs.items() if values}
+        if attrs:
+            mappings[sys.intern(vibe.lower())] = attrs
+
+    return mappings
+
+
+class VibeMatcher:
+    """Matches known vibe phrases in free text with a single automaton pass"""
+
+    def __init__(self, mappings_path: str = "data/vibe_to_attribute.txt"):
+        self.vibe_mappings = _load_vibe_mappings(mappings_path)
+
+        # One Aho-Corasick automaton over all vibe phrases: matching is a
+        # single linear scan regardless of vocabulary size
+        self._automaton = ahocorasick.Automaton()
+        for vibe, attrs in self.vibe_mappings.items():
+            self._automaton.add_word(vibe, (vibe, attrs))
+        self._automaton.make_automaton()
+        self._vibe_keys = list(self.vibe_mappings)
+
+    def extract(self, text: str) -> Dict[str, List[str]]:
+        """Collect attribute hints for every vibe phrase found in the text"""
+        hints: Dict[str, List[str]] = {}
+        lower = text.lower()
+        # iter_long walks the automaton like a DFA, keeping only the longest
+        # match at each position: "flowy dresses for garden-party" no longer
+        # also fires any shorter vibe it contains. Word boundaries are
+        # enforced the way a \b-anchored alternation regex would
+        for end, (vibe, attrs) in self._automaton.iter_long(lower):
+            start = end - len(vibe) + 1
+            before = lower[start - 1] if start > 0 else " "
+            after = lower[end + 1] if end + 1 < len(lower) else " "
+            if before.isalnum() or after.isalnum():
+                continue
+            self._merge_hints(hints, attrs)
+
+        if not hints:
+            # Typo fallback ("comfy lounge teez"): RapidFuzz runs the
+            # Levenshtein work in C++, so this costs microseconds. fuzz.ratio
+            # penalizes length mismatch, and the token-count guard stops a
+            # short input ("dress") from adopting a whole multi-word vibe
+            # just because its tokens are a subset of the key's
+            match = process.extractOne(
+                lower,
+                self._vibe_keys,
+                scorer=fuzz.ratio,
+                score_cutoff=85,
+                processor=None,
+            )
+            if match is not None and abs(
+                len(lower.split()) - len(match[0].split())
+            ) <= 1:
+                self._merge_hints(hints, self.vibe_mappings[match[0]])
+
+        return hints
+
+    @staticmethod
+    def _merge_hints(
+        hints: Dict[str, List[str]], attrs: Dict[str, tuple]
+    ) -> None:
+        for attr, values in attrs.items():
+            existing = hints.setdefault(attr, [])
+            for value in values:
+                if value not in existing:
+                    existing.append(value)
+
+
+@functools.lru_cache(maxsize=4)
+def get_vibe_matcher(
+    mappings_path: str = "data/vibe_to_attribute.txt",
+) -> VibeMatcher:
+    """Shared matcher; the mappings file and automaton are immutable"""
+    return VibeMatcher(mappings_path)
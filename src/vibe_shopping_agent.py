@@ -1,12 +1,450 @@
+from __future__ import annotations
+
 from typing import Dict, List
-import json
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage, SystemMessage, AIMessage, BaseMessage
-from langchain_core.output_parsers import JsonOutputParser
+import asyncio
+import copy
+from concurrent.futures import Future
+from collections import OrderedDict
+import functools
+import hashlib
+import re
+import threading
+import time
+import httpx
+import numpy as np
+import orjson
+import tiktoken
+from diskcache import Cache
 from pydantic import BaseModel, Field
-from src.find_recommendations import OutfitRecommendationAgent, RecommendationResult
+from src.vibe_mappings import get_vibe_matcher
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from langchain_core.messages import BaseMessage
+    from src.find_recommendations import (
+        OutfitRecommendationAgent,
+        RecommendationResult,
+    )
+
+# Filled in by _import_llm_stack; importing langchain/openai eagerly costs
+# over a second of process start even for callers that never build an agent
+ChatOpenAI = None
+DefaultAioHttpClient = None
+JsonOutputParser = None
+StrOutputParser = None
+HumanMessage = None
+SystemMessage = None
+AIMessage = None
+
+
+def _import_llm_stack() -> None:
+    """Import the LangChain/OpenAI stack on first agent construction"""
+    global ChatOpenAI, DefaultAioHttpClient, JsonOutputParser, StrOutputParser
+    global HumanMessage, SystemMessage, AIMessage
+
+    if ChatOpenAI is not None:
+        return
+
+    from langchain_openai import ChatOpenAI as chat_openai
+    from openai import DefaultAioHttpClient as aiohttp_client
+    from langchain_core.messages import (
+        AIMessage as ai_message,
+        HumanMessage as human_message,
+        SystemMessage as system_message,
+    )
+    from langchain_core.output_parsers import (
+        JsonOutputParser as json_output_parser,
+        StrOutputParser as str_output_parser,
+    )
+
+    ChatOpenAI = chat_openai
+    DefaultAioHttpClient = aiohttp_client
+    HumanMessage = human_message
+    SystemMessage = system_message
+    AIMessage = ai_message
+    JsonOutputParser = json_output_parser
+    StrOutputParser = str_output_parser
 
 CONFIDENCE_THRESHOLD = 0.7
+MAX_HISTORY_TOKENS = 3000
+
+# Explicit budget phrases are regular enough for a regex; no LLM needed
+_BUDGET_RANGE_RE = re.compile(r"\$?(\d+)\s*(?:-|\u2013|to|and)\s*\$?(\d+)")
+_BUDGET_MAX_RE = re.compile(
+    r"(?:under|below|less than|at most|up to|around)\s*\$?(\d+)", re.IGNORECASE
+)
+_BUDGET_MIN_RE = re.compile(
+    r"(?:over|above|more than|at least|starting at)\s*\$?(\d+)", re.IGNORECASE
+)
+# Bare numeric ranges ("size 8 to 10") are not budgets; require a dollar
+# sign or budget-ish context before trusting digits
+_BUDGET_CONTEXT_RE = re.compile(
+    r"\$|budget|price|spend|cost|dollar|bucks", re.IGNORECASE
+)
+_BUDGET_KEYWORDS = {
+    "budget-friendly": (None, 50),
+    "affordable": (None, 60),
+    "luxury": (200, None),
+    "expensive": (150, None),
+}
+
+
+# Single-valued constraints where a newer value supersedes the old one;
+# accumulating both would leave the matcher filtering on the stale bound
+_REPLACE_KEYS = frozenset({"budget_min", "budget_max"})
+
+
+def _merge_attrs(old: Dict, new: Dict) -> Dict:
+    """Merge flat attribute -> list-of-{value, confidence} dicts in place,
+    deduplicating values; a generic deep-merge is overkill for this shape"""
+    for key, values in new.items():
+        if key in old and key not in _REPLACE_KEYS:
+            old[key].extend(values)
+        else:
+            old[key] = list(values)
+
+    for key, values in old.items():
+        deduped = {
+            (item["value"], round(item["confidence"], 2)): item for item in values
+        }
+        old[key] = list(deduped.values())
+
+    return old
+
+
+_SIZE_RE = re.compile(r"^(XS|S|M|L|XL|XXL)$", re.IGNORECASE)
+
+# Exact single-value answers to follow-ups ("dress", "party", "flowy")
+_ENUM_FAST_LOOKUP = {
+    value.lower(): (attribute, value)
+    for attribute, values in {
+        "category": ("top", "dress", "skirt", "pants"),
+        "occasion": ("Party", "Vacation", "Everyday", "Evening", "Work"),
+        "fit": (
+            "Relaxed",
+            "Stretch to fit",
+            "Body hugging",
+            "Tailored",
+            "Flowy",
+            "Bodycon",
+            "Oversized",
+            "Sleek and straight",
+            "Slim",
+        ),
+        "length": ("Mini", "Short", "Midi", "Maxi"),
+    }.items()
+    for value in values
+}
+
+
+def _fast_extract(user_input: str):
+    """Parse trivial follow-up answers (sizes, budgets, single enum values)
+    without an LLM round-trip; returns None when the LLM is needed"""
+    text = user_input.strip()
+    if not text or len(text) >= 20:
+        return None
+
+    if _SIZE_RE.match(text):
+        return {"available_sizes": [{"value": text.upper(), "confidence": 1.0}]}
+
+    budget = _parse_budget_phrases(text)
+    if budget is not None:
+        budget_min, budget_max = budget
+        attrs = {}
+        if budget_min is not None:
+            attrs["budget_min"] = [{"value": str(budget_min), "confidence": 1.0}]
+        if budget_max is not None:
+            attrs["budget_max"] = [{"value": str(budget_max), "confidence": 1.0}]
+        return attrs
+
+    enum_hit = _ENUM_FAST_LOOKUP.get(text.lower())
+    if enum_hit is not None:
+        attribute, value = enum_hit
+        return {attribute: [{"value": value, "confidence": 1.0}]}
+
+    return None
+
+
+# O(1) dispatch for offline justification phrases, keyed on normalized
+# (attribute, value); replaces branchy per-call string matching
+_FALLBACK_JUSTIFICATIONS = {
+    ("fit", "relaxed"): "perfect for an easygoing, comfortable look",
+    ("fit", "body hugging"): "made to show off your silhouette",
+    ("fit", "flowy"): "light and breezy for effortless movement",
+    ("fit", "tailored"): "sharp, structured lines that always look put together",
+    ("fabric", "linen"): "breathable linen keeps things cool",
+    ("fabric", "cotton"): "soft all-day cotton comfort",
+    ("fabric", "satin"): "lustrous satin adds evening polish",
+    ("fabric", "velvet"): "plush velvet brings rich texture",
+    ("occasion", "party"): "ready for your next night out",
+    ("occasion", "work"): "polished enough for the office",
+    ("occasion", "vacation"): "made for getaway days",
+    ("occasion", "everyday"): "an easy staple you'll keep reaching for",
+}
+
+
+def _fallback_justification(match: RecommendationResult) -> str:
+    """Deterministic justification used when the LLM is unavailable"""
+    details = match.product_details
+    phrases = [
+        phrase
+        for attr in ("fit", "fabric", "occasion")
+        if (
+            phrase := _FALLBACK_JUSTIFICATIONS.get(
+                (attr, str(details.get(attr, "")).lower())
+            )
+        )
+    ]
+    category = details.get("category", "piece")
+    if phrases:
+        return f"A versatile {category} — {'; '.join(phrases)}."
+    return (
+        f"A versatile {category} that matches your style perfectly "
+        f"with a {match.match_score:.2f} compatibility score."
+    )
+
+
+def _extract_json_object(text: str) -> str:
+    """Slice the first top-level JSON object out of an LLM reply, dropping
+    any surrounding prose or code fences"""
+    start = text.find("{")
+    end = text.rfind("}")
+    return text[start : end + 1] if start != -1 and end > start else text
+
+
+def _parse_budget_phrases(text: str):
+    """Return (budget_min, budget_max) parsed from explicit phrases, or None"""
+    if _BUDGET_CONTEXT_RE.search(text):
+        match = _BUDGET_RANGE_RE.search(text)
+        if match:
+            return int(match.group(1)), int(match.group(2))
+
+        match = _BUDGET_MAX_RE.search(text)
+        if match:
+            return None, int(match.group(1))
+
+        match = _BUDGET_MIN_RE.search(text)
+        if match:
+            return int(match.group(1)), None
+
+    lower = text.lower()
+    for keyword, bounds in _BUDGET_KEYWORDS.items():
+        if keyword in lower:
+            return bounds
+
+    return None
+
+
+@functools.lru_cache(maxsize=1)
+def _shared_http_client() -> httpx.Client:
+    """One keep-alive connection pool for LLM calls across all agent instances"""
+    return httpx.Client(
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+        timeout=httpx.Timeout(60.0, connect=10.0),
+    )
+
+
+class SemanticQueryCache:
+    """Serve near-duplicate vibe queries ("cozy weekend" vs "weekend cozy
+    vibes") from cache instead of a fresh LLM round-trip.
+
+    Shared across the Streamlit worker threads, so all state changes happen
+    under one lock; expired and overflowing entries are evicted rather than
+    left to disable the cache.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.92,
+        ttl_seconds: float = 3600.0,
+        maxsize: int = 512,
+    ):
+        self._threshold = threshold
+        self._ttl_seconds = ttl_seconds
+        self._maxsize = maxsize
+        self._embeddings = None
+        self._values: List = []
+        self._timestamps: List[float] = []
+        self._disk = Cache("data/.semantic_cache")
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._embed_memo: OrderedDict = OrderedDict()
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        return re.sub(r"[^\w\s]", "", text.lower()).strip()
+
+    def _embed(self, text: str) -> np.ndarray:
+        # Reuse the catalog's local embedding model; no extra API calls.
+        # Memoized so the get-then-put sequence on a miss embeds once
+        normalized = self._normalize(text)
+        cached = self._embed_memo.get(normalized)
+        if cached is not None:
+            return cached
+
+        from src.find_recommendations import _load_st_model
+
+        model = _load_st_model("all-MiniLM-L6-v2")
+        embedding = model.encode(
+            [normalized], convert_to_numpy=True, normalize_embeddings=True
+        ).astype(np.float32)[0]
+        self._embed_memo[normalized] = embedding
+        if len(self._embed_memo) > 64:
+            self._embed_memo.popitem(last=False)
+        return embedding
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        entries = self._disk.get("entries") or []
+        for embedding_bytes, value, timestamp in entries:
+            self._append(
+                np.frombuffer(embedding_bytes, dtype=np.float32), value, timestamp
+            )
+
+    def _append(self, embedding: np.ndarray, value, timestamp: float) -> None:
+        row = embedding.reshape(1, -1)
+        if self._embeddings is None:
+            self._embeddings = row
+        else:
+            self._embeddings = np.vstack([self._embeddings, row])
+        self._values.append(value)
+        self._timestamps.append(timestamp)
+
+    def _drop(self, index: int) -> None:
+        self._embeddings = np.delete(self._embeddings, index, axis=0)
+        if not len(self._embeddings):
+            self._embeddings = None
+        del self._values[index]
+        del self._timestamps[index]
+
+    def _evict_expired(self) -> None:
+        now = time.time()
+        for index in range(len(self._timestamps) - 1, -1, -1):
+            if now - self._timestamps[index] > self._ttl_seconds:
+                self._drop(index)
+
+    def _persist(self) -> None:
+        self._disk.set(
+            "entries",
+            [
+                (self._embeddings[i].tobytes(), self._values[i], self._timestamps[i])
+                for i in range(len(self._values))
+            ]
+            if self._embeddings is not None
+            else [],
+        )
+
+    def get(self, text: str):
+        with self._lock:
+            self._load()
+            self._evict_expired()
+            if self._embeddings is None:
+                return None
+            query = self._embed(text)
+            similarities = self._embeddings @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self._threshold:
+                return None
+            # Deep-copy so callers mutating the result can't pollute the cache
+            return copy.deepcopy(self._values[best])
+
+    def put(self, text: str, value) -> None:
+        with self._lock:
+            self._load()
+            self._evict_expired()
+            if len(self._values) >= self._maxsize:
+                # Evict the oldest entry instead of refusing new ones
+                self._drop(0)
+            self._append(self._embed(text), copy.deepcopy(value), time.time())
+            self._persist()
+
+
+@functools.lru_cache(maxsize=1)
+def _semantic_query_cache() -> SemanticQueryCache:
+    return SemanticQueryCache()
+
+
+class _RequestRateLimiter:
+    """Process-wide token bucket spacing out LLM requests across sessions.
+
+    Sessions may run their event loops on different threads (the Streamlit
+    worker pool), so the bookkeeping uses a threading lock held only for the
+    arithmetic, never across an await.
+    """
+
+    def __init__(self, max_requests_per_minute: int = 300):
+        self._interval = 60.0 / max_requests_per_minute
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    async def acquire(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self._interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class _ConcurrencyCap:
+    """Async context manager capping in-flight LLM calls across event loops;
+    asyncio.Semaphore cannot be shared between loops on different threads"""
+
+    def __init__(self, limit: int):
+        self._semaphore = threading.BoundedSemaphore(limit)
+
+    async def __aenter__(self) -> None:
+        await asyncio.to_thread(self._semaphore.acquire)
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self._semaphore.release()
+
+
+# Shared across all agent instances so concurrent sessions are coalesced
+# behind one concurrency cap and one rate budget
+_llm_semaphore = _ConcurrencyCap(8)
+_llm_rate_limiter = _RequestRateLimiter()
+
+
+@functools.lru_cache(maxsize=1)
+def _token_encoding() -> tiktoken.Encoding:
+    """Tokenizer for history budgeting; loaded lazily, shared process-wide"""
+    return tiktoken.get_encoding("o200k_base")
+
+
+@functools.lru_cache(maxsize=1)
+def _extraction_cache() -> Cache:
+    """Persistent cache for attribute extraction; identical vibes skip the LLM"""
+    return Cache("data/.extraction_cache")
+
+
+@functools.lru_cache(maxsize=1)
+def _shared_async_http_client() -> httpx.AsyncClient:
+    """aiohttp-backed async transport; httpx's own async client throttles under
+    many concurrent in-flight requests. Its sessions/connections bind to the
+    persistent LLM loop, so all async LLM work must run there"""
+    return DefaultAioHttpClient(
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+        timeout=httpx.Timeout(60.0, connect=10.0),
+    )
+
+
+@functools.lru_cache(maxsize=1)
+def _llm_event_loop() -> asyncio.AbstractEventLoop:
+    """One persistent event loop for all LLM I/O. Per-turn asyncio.run calls
+    would leave the shared aiohttp transport bound to a dead loop after the
+    first turn; everything async runs here instead"""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="llm-io-loop", daemon=True).start()
+    return loop
+
+
+def run_in_llm_loop(coro) -> Future:
+    """Schedule a coroutine on the persistent LLM loop; returns a
+    concurrent.futures.Future"""
+    return asyncio.run_coroutine_threadsafe(coro, _llm_event_loop())
 
 
 class AttributeValue(BaseModel):
@@ -21,29 +459,33 @@ class AttributeValue(BaseModel):
 class ProductAttributes(BaseModel):
     """Contains all product attributes with their values and confidence scores."""
 
-    category: List[AttributeValue]
-    available_sizes: List[AttributeValue]
-    fit: List[AttributeValue]
-    fabric: List[AttributeValue]
-    sleeve_length: List[AttributeValue]
-    color_or_print: List[AttributeValue]
-    occasion: List[AttributeValue]
-    neckline: List[AttributeValue]
-    length: List[AttributeValue]
-    pant_type: List[AttributeValue]
-    budget_min: List[AttributeValue]
-    budget_max: List[AttributeValue]
+    category: List[AttributeValue] = Field(default_factory=list)
+    available_sizes: List[AttributeValue] = Field(default_factory=list)
+    fit: List[AttributeValue] = Field(default_factory=list)
+    fabric: List[AttributeValue] = Field(default_factory=list)
+    sleeve_length: List[AttributeValue] = Field(default_factory=list)
+    color_or_print: List[AttributeValue] = Field(default_factory=list)
+    occasion: List[AttributeValue] = Field(default_factory=list)
+    neckline: List[AttributeValue] = Field(default_factory=list)
+    length: List[AttributeValue] = Field(default_factory=list)
+    pant_type: List[AttributeValue] = Field(default_factory=list)
+    budget_min: List[AttributeValue] = Field(default_factory=list)
+    budget_max: List[AttributeValue] = Field(default_factory=list)
 
 
 class AttributeExtraction(BaseModel):
-    """Main model containing product attributes and follow-up questions."""
+    """Main model containing follow-up questions and product attributes.
+
+    follow_up comes first so it is emitted at the start of the streamed
+    response instead of after the full attributes object.
+    """
 
+    follow_up: str = Field(
+        default="", description="A precise question to improve low-confidence attributes"
+    )
     attributes: ProductAttributes = Field(
         description="Extracted clothing attributes with confidence scores"
     )
-    follow_up: str = Field(
-        description="A precise question to improve low-confidence attributes"
-    )
 
 
 class Product(BaseModel):
@@ -65,68 +507,248 @@ class BatchProductsWithJustification(BaseModel):
 
 
 class VibeShoppingAgent:
-    def __init__(self):
+    def __init__(self, recommendation_agent: OutfitRecommendationAgent = None):
         """Initialize the LLM-based vibe shopping agent"""
+        _import_llm_stack()
         self.conversation = []
+        # LangChain mirror of the conversation, appended to in O(1) per turn,
+        # with per-message token counts and digests maintained alongside
+        self._lc_messages: List[BaseMessage] = []
+        self._token_counts: List[int] = []
+        self._message_digests: List[bytes] = []
+        # Last few distinct user inputs, deduplicated for prompt context
+        self._distinct_user_inputs: List[str] = []
+        self._distinct_inputs_json = "[]"
+        self._max_distinct_inputs = 5
         self.attributes: ProductAttributes = {}
         self.follow_up_count = 0
         self.max_follow_ups = 2
-        self.recommendation_agent = OutfitRecommendationAgent()
-
-        self.llm = ChatOpenAI(model="gpt-4.1-mini", temperature=0.7)
+        if recommendation_agent is not None:
+            self.recommendation_agent = recommendation_agent
+
+        # Deterministic extraction keeps the on-disk cache semantically safe
+        self.extraction_llm = ChatOpenAI(
+            model="gpt-4.1-mini",
+            temperature=0.0,
+            streaming=True,
+            use_responses_api=True,
+            http_client=_shared_http_client(),
+            http_async_client=_shared_async_http_client(),
+        )
+        # Justifications are light stylistic rewriting; the lightest model
+        # that holds up stylistically keeps the recommendation path snappy
+        self.justification_llm = ChatOpenAI(
+            model="gpt-4.1-nano",
+            temperature=0.7,
+            streaming=True,
+            http_client=_shared_http_client(),
+            http_async_client=_shared_async_http_client(),
+        )
 
-        # Initialize parsers
-        self.attribute_parser = JsonOutputParser(pydantic_object=AttributeExtraction)
+        # Structured outputs via function calling return validated pydantic
+        # objects directly, with no format-instructions block in the prompt
+        self.extract_chain = self.extraction_llm.with_structured_output(
+            AttributeExtraction, method="json_schema", strict=True
+        )
         self.justification_parser = JsonOutputParser(
             pydantic_object=BatchProductsWithJustification
         )
+        # Raw text out of the model; validation happens in pydantic-core
+        # (jiter-backed) instead of LangChain's json.loads-based parser
+        self.justify_chain = self.justification_llm | StrOutputParser()
 
-    def process_query(self, user_input: str) -> None:
+        # Static justification prompt, rendered once (schema walk included)
+        self._justification_system_prompt = f"""You are a fashion stylist explaining why products match a customer's request.
+
+## Instructions:
+
+* Create a brief, enthusiastic justification (1-2 sentences each) that highlights the key features that make each item perfect for them.
+* **Conversation history**: Messages sent by the customer to build the customer's preferences.
+* **Style Preferences**: Customer's style preferences.
+* **Products to justify**: Products that match the customer's preferences from the catalog, as a JSON list.
+* **Think step by step** about the customer's conversation history and style preferences and how they match the products. Consider the mood, style, occasion, and any specific details mentioned.
+* Focus on the matched attributes and make it personal and engaging.
+* Return one justification per product, in the same order as the input list.
+
+## Format instructions:
+{self.justification_parser.get_format_instructions()}
+"""
+
+        # The system prompt is now fully static: byte-identical across turns
+        # so OpenAI's automatic prefix caching hits from the second call on
+        self._static_system_prompt = self._get_system_prompt().format(
+            confidence_threshold=0.5
+        )
+        self._system_prompt_digest = hashlib.blake2b(
+            self._static_system_prompt.encode(), digest_size=16
+        ).digest()
+
+        # LRU of attribute signature -> matches; follow-up turns often leave
+        # the attributes unchanged
+        self._recommendation_cache: OrderedDict = OrderedDict()
+        self._recommendation_cache_size = 128
+
+    @property
+    def attributes(self) -> Dict:
+        return self._attributes
+
+    @attributes.setter
+    def attributes(self, value: Dict) -> None:
+        self._attributes = value
+        self._attributes_json_cache = None
+
+    @property
+    def _attributes_json(self) -> str:
+        """Canonical serialized attributes, recomputed only after mutation"""
+        if self._attributes_json_cache is None:
+            self._attributes_json_cache = orjson.dumps(
+                self._attributes, option=orjson.OPT_SORT_KEYS
+            ).decode()
+        return self._attributes_json_cache
+
+    @functools.cached_property
+    def recommendation_agent(self) -> OutfitRecommendationAgent:
+        """Built on first use and shared across sessions; sessions that never
+        reach recommendations skip the catalog load and embedding precompute"""
+        from src.find_recommendations import get_recommendation_agent
+
+        return get_recommendation_agent()
+
+    async def process_query(self, user_input: str) -> str:
         """Main method to process user input and return appropriate response"""
         self.conversation.append({"role": "user", "content": user_input})
+        self._append_lc_message(HumanMessage(content=user_input))
+        self._note_user_input(user_input)
+
+        budget = _parse_budget_phrases(user_input)
+
+        # Short follow-up answers ("M", "$50", "dress") parse deterministically
+        fast_attrs = _fast_extract(user_input) if len(self.conversation) > 1 else None
+
+        # Fresh conversations can reuse answers for near-duplicate vibes;
+        # later turns depend on history, so they always go to the LLM.
+        # The cache's encode/disk work is CPU-bound and runs via to_thread so
+        # it never stalls the shared LLM loop's in-flight requests
+        fresh_turn = len(self.conversation) == 1 and not self.attributes
+        cached = (
+            await asyncio.to_thread(_semantic_query_cache().get, user_input)
+            if fresh_turn
+            else None
+        )
+        if fast_attrs is not None:
+            attributes_new, follow_up = fast_attrs, ""
+        elif cached is not None:
+            attributes_new, follow_up = cached
+        else:
+            attributes_new, follow_up = await self._extract_attributes_llm()
+            if fresh_turn:
+                await asyncio.to_thread(
+                    _semantic_query_cache().put,
+                    user_input,
+                    (attributes_new, follow_up),
+                )
 
-        attributes_new, follow_up = self._extract_attributes_llm()
-        # self.attributes = always_merger.merge(self.attributes, attributes_new)
-        self.attributes = attributes_new
-
-        if follow_up and self.follow_up_count < self.max_follow_ups:
+        # A deterministic budget parse beats whatever the LLM inferred
+        if budget is not None:
+            budget_min, budget_max = budget
+            if budget_min is not None:
+                attributes_new["budget_min"] = [
+                    {"value": str(budget_min), "confidence": 1.0}
+                ]
+            if budget_max is not None:
+                attributes_new["budget_max"] = [
+                    {"value": str(budget_max), "confidence": 1.0}
+                ]
+
+        # Known vibe phrases contribute deterministic attribute hints for
+        # anything the LLM left unfilled
+        vibe_hints = get_vibe_matcher().extract(user_input)
+        for attr, values in vibe_hints.items():
+            if attr not in attributes_new:
+                attributes_new[attr] = [
+                    {"value": value, "confidence": CONFIDENCE_THRESHOLD}
+                    for value in values
+                ]
+
+        self.attributes = _merge_attrs(self.attributes, attributes_new)
+
+        # The need for a follow-up is decided client-side from what is
+        # actually missing; the LLM only supplies the wording
+        follow_up = self._choose_follow_up(follow_up)
+        if follow_up:
             self.follow_up_count += 1
             response = f"Great! I found some lovely options for '{user_input}'. "
             response += f"To help me find the perfect pieces for you, {follow_up}"
 
             self.conversation.append({"role": "assistant", "content": response})
+            self._append_lc_message(AIMessage(content=response))
         else:
-            response = self._generate_recommendations()
+            response = await self._generate_recommendations()
             self.conversation.append({"role": "assistant", "content": response})
+            self._append_lc_message(AIMessage(content=response))
+
+        self._trim_history()
+        return response
+
+    def _choose_follow_up(self, llm_follow_up: str) -> str:
+        """Pick a follow-up question deterministically, in priority order"""
+        if self.follow_up_count >= self.max_follow_ups:
+            return ""
+        if not self.attributes.get("category"):
+            return llm_follow_up or "Do you prefer dresses, or tops and bottoms?"
+        if not self.attributes.get("available_sizes"):
+            return llm_follow_up or "What size are you looking for?"
+        if not self.attributes.get("budget_min") and not self.attributes.get(
+            "budget_max"
+        ):
+            return llm_follow_up or "What's your budget range?"
+        return ""
+
+    def _note_user_input(self, user_input: str) -> None:
+        """Track the last few distinct user inputs, dropping near-duplicates"""
+        normalized = user_input.strip().lower()
+        if normalized in (text.strip().lower() for text in self._distinct_user_inputs):
+            return
+        self._distinct_user_inputs.append(user_input)
+        if len(self._distinct_user_inputs) > self._max_distinct_inputs:
+            self._distinct_user_inputs.pop(0)
+        self._distinct_inputs_json = orjson.dumps(
+            self._distinct_user_inputs, option=orjson.OPT_INDENT_2
+        ).decode()
+
+    def _append_lc_message(self, message: BaseMessage) -> None:
+        """Append to the LLM history, tokenizing and fingerprinting exactly once"""
+        self._lc_messages.append(message)
+        self._token_counts.append(len(_token_encoding().encode(message.content)))
+        self._message_digests.append(
+            hashlib.blake2b(message.content.encode(), digest_size=16).digest()
+        )
+
+    def _trim_history(self) -> None:
+        """Keep the LLM-visible history within a fixed token budget"""
+        total = sum(self._token_counts)
+        while self._lc_messages and total > MAX_HISTORY_TOKENS:
+            self._lc_messages.pop(0)
+            self._message_digests.pop(0)
+            total -= self._token_counts.pop(0)
 
     def _get_system_prompt(self) -> str:
         return """You are a fashion item conversion agent. Your job is to take a vibe description and convert it into a structured JSON format with the following fields:
 
 ## Available Choices (use these when possible):
 
-**category**: top, dress, skirt, pants
-
-**available_sizes**: XS,S,M,L,XL (or subsets like XS,S,M or S,M,L,XL)
-
-**fit**: Relaxed, Stretch to fit, Body hugging, Tailored, Flowy, Bodycon, Oversized, Sleek and straight, Slim
-
-**fabric**: Linen, Silk, Cotton, Rayon, Satin, Modal jersey, Crepe, Tencel, Chambray, Velvet, Silk chiffon, Bamboo jersey, Linen blend, Ribbed knit, Tweed, Organza overlay, Sequined velvet, Cotton-blend, Crushed velvet, Tulle, Denim, Wool-blend, Scuba knit, Linen-blend, Polyester georgette, Cotton twill, Ribbed jersey, Poly-crepe, Viscose voile, Vegan leather, Lamé, Polyester twill, Stretch denim, Tencel-blend, Chiffon, Cotton poplin, Cotton gauze, Lace overlay, Tencel twill, Sequined mesh, Viscose
-
-**sleeve_length**: Short Flutter Sleeves, Cropped, Long sleeves with button cuffs, Sleeveless, Full sleeves, Short sleeves, Quarter sleeves, Straps, Long sleeves, Spaghetti straps, Short flutter sleeves, Tube, Balloon sleeves, Halter, Bishop sleeves, One-shoulder, Cap sleeves, Cropped long sleeves, Bell sleeves, Short puff sleeves
-
-**color_or_print**: Pastel yellow, Deep blue, Floral print, Red, Off-white, Pastel pink, Aqua blue, Green floral, Charcoal, Pastel coral, Dusty rose, Seafoam green, Multicolor mosaic print, Pastel floral, Storm grey, Cobalt blue, Blush pink, Sunflower yellow, Aqua wave print, Black iridescent, Orchid purple, Amber gold, Watercolor petals, Stone/black stripe, Sage green, Ruby red, Soft teal, Charcoal marled, Lavender, Ombre sunset, Coral stripe, Jet black, Olive green, Mustard yellow, Silver metallic, Teal abstract print, Lavender haze, Warm taupe, Black polka dot, Midnight navy sequin, Sunshine yellow, Charcoal pinstripe, Plum purple, Mid-wash indigo, Emerald green, Mustard windowpane check, Sand beige, Ruby red micro–dot, Terracotta, Heather quartz, Goldenrod yellow, Deep-wash indigo, Sapphire blue, Peony watercolor print, Slate grey, Emerald green grid check, Bronze metallic, Classic indigo, Stone beige, Sand taupe, Graphite grey, Platinum grey
-
-**occasion**: Party, Vacation, Everyday, Evening, Work, Vocation
-
-**neckline**: Sweetheart, Square neck, V neck, Boat neck, Tubetop, Halter, Cowl neck, One-shoulder, Collar, Illusion bateau, Round neck, Polo collar
-
-**length**: Mini, Short, Midi, Maxi
-
-**pant_type**: Wide-legged, Ankle length, Flared, Wide hem, Straight ankle, Mid-rise, Low-rise
-
-**budget_min**: Minimum price range (e.g., 10, 20, 30, 50, 100)
-
-**budget_max**: Maximum price range (e.g., 50, 100, 150, 200, 300)
+category: top, dress, skirt, pants
+available_sizes: XS,S,M,L,XL (or subsets like XS,S,M or S,M,L,XL)
+fit: Relaxed, Stretch to fit, Body hugging, Tailored, Flowy, Bodycon, Oversized, Sleek and straight, Slim
+fabric: Linen, Silk, Cotton, Rayon, Satin, Modal jersey, Crepe, Tencel, Chambray, Velvet, Silk chiffon, Bamboo jersey, Linen blend, Ribbed knit, Tweed, Organza overlay, Sequined velvet, Cotton-blend, Crushed velvet, Tulle, Denim, Wool-blend, Scuba knit, Linen-blend, Polyester georgette, Cotton twill, Ribbed jersey, Poly-crepe, Viscose voile, Vegan leather, Lamé, Polyester twill, Stretch denim, Tencel-blend, Chiffon, Cotton poplin, Cotton gauze, Lace overlay, Tencel twill, Sequined mesh, Viscose
+sleeve_length: Short Flutter Sleeves, Cropped, Long sleeves with button cuffs, Sleeveless, Full sleeves, Short sleeves, Quarter sleeves, Straps, Long sleeves, Spaghetti straps, Short flutter sleeves, Tube, Balloon sleeves, Halter, Bishop sleeves, One-shoulder, Cap sleeves, Cropped long sleeves, Bell sleeves, Short puff sleeves
+color_or_print: Pastel yellow, Deep blue, Floral print, Red, Off-white, Pastel pink, Aqua blue, Green floral, Charcoal, Pastel coral, Dusty rose, Seafoam green, Multicolor mosaic print, Pastel floral, Storm grey, Cobalt blue, Blush pink, Sunflower yellow, Aqua wave print, Black iridescent, Orchid purple, Amber gold, Watercolor petals, Stone/black stripe, Sage green, Ruby red, Soft teal, Charcoal marled, Lavender, Ombre sunset, Coral stripe, Jet black, Olive green, Mustard yellow, Silver metallic, Teal abstract print, Lavender haze, Warm taupe, Black polka dot, Midnight navy sequin, Sunshine yellow, Charcoal pinstripe, Plum purple, Mid-wash indigo, Emerald green, Mustard windowpane check, Sand beige, Ruby red micro–dot, Terracotta, Heather quartz, Goldenrod yellow, Deep-wash indigo, Sapphire blue, Peony watercolor print, Slate grey, Emerald green grid check, Bronze metallic, Classic indigo, Stone beige, Sand taupe, Graphite grey, Platinum grey
+occasion: Party, Vacation, Everyday, Evening, Work, Vocation
+neckline: Sweetheart, Square neck, V neck, Boat neck, Tubetop, Halter, Cowl neck, One-shoulder, Collar, Illusion bateau, Round neck, Polo collar
+length: Mini, Short, Midi, Maxi
+pant_type: Wide-legged, Ankle length, Flared, Wide hem, Straight ankle, Mid-rise, Low-rise
+budget_min: Minimum price range (e.g., 10, 20, 30, 50, 100)
+budget_max: Maximum price range (e.g., 50, 100, 150, 200, 300)
 
 ## Instructions:
 
@@ -170,22 +792,17 @@ class VibeShoppingAgent:
 
 * **Size Handling**: Look for size related phrases like skinny or tall or petite or plus size or small or medium and so on to make judgements.
 
-* **Existing System Generated Attributes:** Attributes generated by you in previous iterations are available to you.
+* **Existing System Generated Attributes:** Attributes generated by you in previous iterations are provided at the end of the conversation.
     - Use them to improve your understanding of the user's preferences and needs.
     - Add and remove attributes as per improvement in your understanding of the user's preferences and needs.
 
-## Existing System Generated Attributes:
-{current_attributes}
-
-## Format instructions:
-{format_instructions}
-
 ## Example Input/Output:
 
 **Input**: "Cozy coffee shop vibes for a weekend brunch between $30 and $75"
 **Output**: 
 ```json
 {{
+    "follow_up": "Any must-haves like sleeveless, budget or size to keep in mind?",
     "attributes": {{
         "category": [{{"value": "top", "confidence": 0.8}}, {{"value": "dress", "confidence": 0.6}}],
         "available_sizes": [{{"value": "", "confidence": 0.0}}],
@@ -199,86 +816,103 @@ class VibeShoppingAgent:
         "pant_type": [{{"value": "", "confidence": 0.0}}],
         "budget_min": [{{"value": "30", "confidence": 0.9}}],
         "budget_max": [{{"value": "75", "confidence": 0.9}}]
-    }},
-    "follow_up": "Any must-haves like sleeveless, budget or size to keep in mind?",
+    }}
 }}
 ```
 """
 
-    def _extract_attributes_llm(self):
+    async def _extract_attributes_llm(self):
         """Extract attributes from user input using LLM"""
         try:
-            system_content = self._get_system_prompt().format(
-                current_attributes=json.dumps(self.attributes),
-                format_instructions=self.attribute_parser.get_format_instructions(),
-                confidence_threshold=0.5,
-            )
-            messages: List[BaseMessage] = [SystemMessage(content=system_content)]
-
-            # Add conversation history
-            for msg in self.conversation:
-                if msg["role"] == "user":
-                    messages.append(HumanMessage(content=msg["content"]))
-                elif msg["role"] == "assistant":
-                    messages.append(AIMessage(content=msg["content"]))
-
-            # Create chain and invoke
-            chain = self.llm | self.attribute_parser
-            result: Dict = chain.invoke(messages)
-
-            # Extract attributes from the new format
-            raw_attributes: Dict = result.get("attributes", {})
-            follow_up: str = result.get("follow_up", "")
-
-            # Keep the full format with confidence scores for better attribute handling
-            extracted_attrs = {}
-            for key, attr_list in raw_attributes.items():
-                if not isinstance(attr_list, List):
-                    continue
-
-                if key not in extracted_attrs:
-                    extracted_attrs[key] = []
-
-                for attr_item in attr_list:
-                    if not isinstance(attr_item, Dict):
-                        continue
-
-                    value = attr_item.get("value", "")
-                    confidence = attr_item.get("confidence", 0.0)
-
-                    # Only include attributes with values and decent confidence
-                    if not value or confidence < CONFIDENCE_THRESHOLD:
-                        continue
-
-                    # Preserve the full AttributeValue structure
-                    extracted_attrs[key].append(
-                        {"value": value, "confidence": confidence}
-                    )
+            # Dynamic state rides in a trailing message so the static prefix
+            # (system prompt + append-only history) stays cacheable
+            attributes_json = self._attributes_json
+            messages: List[BaseMessage] = [
+                SystemMessage(content=self._static_system_prompt),
+                *self._lc_messages,
+                HumanMessage(
+                    content="## Existing System Generated Attributes:\n"
+                    + attributes_json
+                ),
+            ]
 
+            # Identical model + messages means an identical (temperature 0)
+            # answer, so serve repeats from the on-disk cache
+            cache_key = hashlib.sha256(
+                self.extraction_llm.model_name.encode()
+                + self._system_prompt_digest
+                + b"".join(self._message_digests)
+                + hashlib.blake2b(attributes_json.encode(), digest_size=16).digest()
+            ).hexdigest()
+            cached = _extraction_cache().get(cache_key)
+            if cached is not None:
+                return cached
+
+            async with _llm_semaphore:
+                await _llm_rate_limiter.acquire()
+                parsed: AttributeExtraction = await self.extract_chain.ainvoke(
+                    messages
+                )
+            follow_up: str = parsed.follow_up
+
+            # Single pass: keep confident values, drop empty attributes
+            extracted_attrs = {
+                field: confident
+                for field in ProductAttributes.model_fields
+                if (
+                    confident := [
+                        {"value": item.value, "confidence": item.confidence}
+                        for item in getattr(parsed.attributes, field)
+                        if item.value and item.confidence >= CONFIDENCE_THRESHOLD
+                    ]
+                )
+            }
+
+            _extraction_cache().set(cache_key, (extracted_attrs, follow_up))
             return extracted_attrs, follow_up
         except Exception as e:
             print(f"Error extracting attributes: {e}")
             return {}, ""
 
-    def _generate_recommendations(self) -> str:
+    async def _generate_recommendations(self) -> str:
         """Generate product recommendations using the recommendation agent"""
         try:
-            matches = self.recommendation_agent.find_recommendations(self.attributes)
+            max_results = 3
+            cache_key = hashlib.blake2b(
+                f"{self._attributes_json}|{max_results}".encode()
+            ).digest()
+            matches = self._recommendation_cache.get(cache_key)
+            if matches is None:
+                # Embedding + matching is CPU-bound; run it on a worker thread.
+                # Only the three displayed products are ever materialized
+                matches = await asyncio.to_thread(
+                    functools.partial(
+                        self.recommendation_agent.find_recommendations,
+                        self.attributes,
+                        max_results=max_results,
+                    )
+                )
+                self._recommendation_cache[cache_key] = matches
+                if len(self._recommendation_cache) > self._recommendation_cache_size:
+                    self._recommendation_cache.popitem(last=False)
+            else:
+                self._recommendation_cache.move_to_end(cache_key)
 
             if not matches:
                 return "I couldn't find any matches for your preferences. Would you like to try a different style or adjust your requirements?"
 
-            # Get top 3 recommendations
-            top_matches = matches[:3]
-
-            products_with_justifications = self._generate_justification_llm(top_matches)
+            products_with_justifications = await self._generate_justification_llm(
+                matches
+            )
 
             # Generate response with LLM-enhanced justifications
-            response = "Here are my top picks for you:\n\n"
+            parts = ["Here are my top picks for you:\n\n"]
             for i, match in enumerate(products_with_justifications, 1):
-                response += f"{i}. **{match.product.name}** (${match.product.price})\n {match.justification}\n\n"
+                parts.append(
+                    f"{i}. **{match.product.name}** (${match.product.price})\n {match.justification}\n\n"
+                )
 
-            return response
+            return "".join(parts)
 
         except ValueError as e:
             return str(e)
@@ -286,87 +920,87 @@ class VibeShoppingAgent:
             print(f"Error finding recommendations: {str(e)}")
             return "I encountered an error finding recommendations. Please try again."
 
-    def _generate_justification_llm(
+    async def _generate_justification_llm(
         self, matches: List[RecommendationResult]
     ) -> List[ProductWithJustification]:
-        """Generate LLM-based justification for product recommendations"""
-        results = []
-
-        try:
-            system_message = f"""You are a fashion stylist explaining why products match a customer's request.
-
-## Instructions:
-
-* Create a brief, enthusiastic justifications (1-2 sentences each) that highlight the key features that make each item perfect for them.
-* **Conversation history**: Messages sent by the customer to build the customer's preferences.
-* **Style Preferences**: Customer's style preferences.
-* **Products to justify**: Products that match the customer's preferences from the catalog.
-* **Think step by step** about the customer's conversation history and style preferences and how they match the products. Consider the mood, style, occasion, and any specific details mentioned.
-* Focus on the matched attributes and make it personal and engaging.
-
-## Format instructions:
-{self.justification_parser.get_format_instructions()}
-"""
-
-            products_info: List[Dict] = []
-            for i, match in enumerate(matches, 1):
-                product_details = match.product_details
-                price = product_details.get("price", "Price not available")
-
-                product_info = {
-                    "number": i,
-                    "name": match.product_name,
-                    "price": str(price),
-                    "match_score": match.match_score,
-                    "matched_attributes": match.matched_attributes,
-                    "product_details": product_details,
-                    "reasoning": match.reasoning,
-                }
-                products_info.append(product_info)
-
-            user_message = f"""
+        """Generate LLM-based justifications for all products in one round-trip"""
+        conversation_history = self._distinct_inputs_json
+        style_preferences = self._attributes_json
+
+        # Keep the payload lean for the small model: name, category, price
+        # and the matched attributes carry all the signal it needs
+        products_info: List[Dict] = [
+            {
+                "number": i,
+                "name": match.product_name,
+                "category": match.product_details.get("category", ""),
+                "price": str(match.product_details.get("price", "Price not available")),
+                "matched_attributes": match.matched_attributes,
+            }
+            for i, match in enumerate(matches, 1)
+        ]
+
+        user_message = f"""
 ## Conversation history:
-{json.dumps([msg["content"] for msg in self.conversation if msg["role"] == "user"], indent=2)}
+{conversation_history}
 
 ## Style preferences:
-{json.dumps(self.attributes, indent=2)}
+{style_preferences}
 
 ## Products to justify:
-{json.dumps(products_info, indent=2)}
+{orjson.dumps(products_info, option=orjson.OPT_INDENT_2).decode()}
 
 Please provide enthusiastic justifications for each product explaining why it matches the customer's preferences."""
 
-            messages = [
-                SystemMessage(content=system_message),
-                HumanMessage(content=user_message),
-            ]
-
-            # Use the JSON parser for structured output
-            chain = self.llm | self.justification_parser
-            response: Dict = chain.invoke(messages)
-
-            for match in response.get("products", []):
-                results.append(ProductWithJustification(**match))
+        messages = [
+            SystemMessage(content=self._justification_system_prompt),
+            HumanMessage(content=user_message),
+        ]
 
+        try:
+            async with _llm_semaphore:
+                await _llm_rate_limiter.acquire()
+                # Accumulate streamed text deltas; parsing happens once the
+                # stream closes (the transport-level win is that a stalled
+                # response surfaces immediately rather than at body timeout)
+                chunks: List[str] = []
+                async for chunk in self.justify_chain.astream(messages):
+                    chunks.append(chunk)
+
+            parsed = BatchProductsWithJustification.model_validate_json(
+                _extract_json_object("".join(chunks))
+            )
+            results = parsed.products
+            if len(results) == len(matches):
+                return results
+            print(
+                f"Expected {len(matches)} justifications, got {len(results)}; "
+                "falling back"
+            )
         except Exception as e:
             print(f"Error generating justifications: {e}")
-            # Return fallback justifications if LLM fails
-            for match in matches:
-                product_details = match.product_details
-                price = product_details.get("price", "Price not available")
-
-                results.append(
-                    ProductWithJustification(
-                        product=Product(name=match.product_name, price=str(price)),
-                        justification=f"A versatile {product_details.get('category', 'piece')} that matches your style perfectly with a {match.match_score:.2f} compatibility score.",
-                    )
+
+        # Fall back to deterministic justifications if the LLM fails
+        results = []
+        for match in matches:
+            price = match.product_details.get("price", "Price not available")
+            results.append(
+                ProductWithJustification(
+                    product=Product(name=match.product_name, price=str(price)),
+                    justification=_fallback_justification(match),
                 )
+            )
 
         return results
 
     def reset_conversation(self) -> None:
         """Reset the conversation state"""
         self.conversation = []
+        self._lc_messages = []
+        self._token_counts = []
+        self._message_digests = []
+        self._distinct_user_inputs = []
+        self._distinct_inputs_json = "[]"
         self.attributes = {}
         self.follow_up_count = 0
 
@@ -392,7 +1026,7 @@ if __name__ == "__main__":
             continue
 
         try:
-            response = agent.process_query(user_input)
+            response = run_in_llm_loop(agent.process_query(user_input)).result()
             print(f"\nStylist: {response}\n")
         except Exception as e:
             print(f"Sorry, I encountered an error: {e}")